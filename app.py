@@ -6,15 +6,22 @@ import pandas as pd
 import streamlit as st
 
 from recommender import (
-    load_data, build_feature_matrix, compute_similarity,
+    load_data, fit_feature_encoders, build_feature_csr, build_similarity,
+    update_catalog, compact_mode,
     get_top_quality, recommend_by_tags, recommend_hybrid,
 )
+from result_cache import RESULT_CACHE
+from retrieval import FUSIONS, retrieve_fused
 
 DATA_PATH   = Path("data/nintendo_games_enriched.csv")
-INTER_CSV   = Path("data/interactions.csv")
+UPDATE_CSV  = Path("data/catalog_updates.csv")   # 新增/修改的游戏，格式同 DATA_PATH
 PLACEHOLDER = "https://raw.githubusercontent.com/streamlit/streamlit/master/examples/data/0.png"
 
 FAV_FILE    = Path("favorites.json")
+UID_PAGE    = 50   # user_id 下拉框每页条数
+
+def _mtime(p: Path) -> float:
+    return p.stat().st_mtime if p.exists() else 0.0
 
 def _load_fav_set() -> set[int]:
     if FAV_FILE.exists():
@@ -26,15 +33,28 @@ def _save_fav_set(fav_set: set[int]):
     with open(FAV_FILE, "w", encoding="utf-8") as f:
         json.dump(sorted(list(fav_set)), f, ensure_ascii=False, indent=2)
 
-@st.cache_data
-def _init_all():
+# cache_resource：各次 rerun / 会话共享同一对象，不做 pickle 拷贝 (调用方勿原地修改)
+@st.cache_resource(max_entries=1)
+def _init_all(mtime: float, compact: bool):
+    # mtime / compact 作为缓存键：DATA_PATH 或模式变化后重新构建
     df   = load_data(DATA_PATH)
-    feat = build_feature_matrix(df)
-    sim  = compute_similarity(feat)
-    uid  = sorted(pd.read_csv(INTER_CSV)["user_id"].unique().tolist())
-    return df, sim, uid
-
-df, sim_df, uid_all = _init_all()
+    enc  = fit_feature_encoders(df)
+    feat = build_feature_csr(df, enc)   # 稀疏特征常驻，供增量更新打分
+    sim, report = build_similarity(feat, df.index, compact)
+    return df, feat, sim, enc, report
+
+@st.cache_resource(max_entries=1)
+def _apply_updates(base_mtime: float, compact: bool, mtime: float):
+    # 以文件修改时间为版本：只对更新部分打分，不重建全量相似度
+    df, feat, sim, enc, _ = _init_all(base_mtime, compact)
+    df, feat, sim = update_catalog(df, feat, sim, enc, load_data(UPDATE_CSV))
+    return df, sim
+
+COMPACT = compact_mode()
+df, _, sim_df, _, sim_report = _init_all(_mtime(DATA_PATH), COMPACT)
+if UPDATE_CSV.exists():
+    df, sim_df = _apply_updates(_mtime(DATA_PATH), COMPACT, _mtime(UPDATE_CSV))
+data_ver = (_mtime(DATA_PATH), _mtime(UPDATE_CSV), COMPACT)   # 目录变化 → 缓存结果失效
 
 if "fav_set" not in st.session_state:
     st.session_state["fav_set"] = _load_fav_set()
@@ -100,13 +120,15 @@ def _render(df_show: pd.DataFrame, prefix: str):
             use_container_width=True
         )
 
-tab_hot, tab_tag, tab_sim, tab_tower = st.tabs(
-    ["🔥 高质量热门", "🏷️ 标签推荐", "🔍 相似游戏", "🧠 深度召回"]
+tab_hot, tab_tag, tab_sim, tab_tower, tab_fuse = st.tabs(
+    ["🔥 高质量热门", "🏷️ 标签推荐", "🔍 相似游戏", "🧠 深度召回", "🧩 融合推荐"]
 )
 
 with tab_hot:
     st.subheader("🔥 高质量热门")
-    _render(get_top_quality(df_flt, top_n), "hot")
+    _render(RESULT_CACHE.get_or_compute(
+        "quality", {"n": top_n}, df_flt, data_ver,
+        lambda: get_top_quality(df_flt, top_n)), "hot")
 
 with tab_tag:
     st.subheader("🏷️ 标签推荐")
@@ -115,7 +137,9 @@ with tab_tag:
                    if q.lower() in t.lower()})
     tag_sel = st.multiselect("选择标签", pool)
     if tag_sel:
-        _render(recommend_by_tags(df_flt.copy(), tag_sel, top_n), "tag")
+        _render(RESULT_CACHE.get_or_compute(
+            "tags", {"tags": set(tag_sel), "n": top_n}, df_flt, data_ver,
+            lambda: recommend_by_tags(df_flt.copy(), tag_sel, top_n)), "tag")
     else:
         st.info("请选择标签")
 
@@ -126,8 +150,10 @@ with tab_sim:
     sim_sub  = sim_df.loc[df_flt.index, df_flt.index]
 
     if st.button("生成推荐", key="btn_sim"):
-        st.session_state["sim_recs"] = recommend_hybrid(
-            df_flt, sim_sub, game_sel, top_n, alpha
+        st.session_state["sim_recs"] = RESULT_CACHE.get_or_compute(
+            "hybrid", {"game": game_sel, "n": top_n, "alpha": alpha},
+            df_flt, data_ver,
+            lambda: recommend_hybrid(df_flt, sim_sub, game_sel, top_n, alpha)
         )
 
     if "sim_recs" in st.session_state:
@@ -138,20 +164,43 @@ with tab_tower:
     st.caption("基于训练好的用户/游戏向量的大规模召回 Top-N")
 
     import tower_utils as tw
-    uid_all = tw.get_all_user_ids()
-
-    demo_uid = st.session_state.get("demo_uid", random.choice(uid_all))
-    uid_sel  = st.selectbox("选择 user_id", uid_all,
-                            index=uid_all.index(demo_uid))
+    uid_idx = tw.get_all_user_ids()
+
+    def _pick_random_uid():
+        # 回调在脚本重跑前执行，可以直接改写带 key 的控件状态
+        uid = int(random.choice(uid_idx.ids))
+        st.session_state["demo_uid"] = uid
+        st.session_state["uid_page"] = uid_idx.position(uid) // UID_PAGE + 1
+        st.session_state["uid_q"]    = ""
+        st.session_state["uid_sel"]  = uid
+
+    if "demo_uid" not in st.session_state:
+        _pick_random_uid()
+
+    uid_q = st.text_input("搜索 user_id (前缀)", key="uid_q").strip()
+    if uid_q:
+        uid_opts = uid_idx.search(uid_q, UID_PAGE)
+        if not uid_opts:
+            st.caption("没有匹配的 user_id")
+            uid_opts = [st.session_state["demo_uid"]]
+        if st.session_state.get("uid_q_last") != uid_q:
+            st.session_state["uid_sel"] = uid_opts[0]   # 新查询默认选中第一条结果
+    else:
+        n_page   = max(1, -(-len(uid_idx) // UID_PAGE))
+        page     = st.number_input("页码", 1, n_page, key="uid_page",
+                                   help=f"共 {n_page} 页，每页 {UID_PAGE} 个")
+        uid_opts = uid_idx.page(page - 1, UID_PAGE)
+    st.session_state["uid_q_last"] = uid_q
+    if st.session_state.get("uid_sel") not in uid_opts:
+        st.session_state["uid_sel"] = uid_opts[0]
+    uid_sel  = st.selectbox("选择 user_id", uid_opts, key="uid_sel")
 
-    if st.button("🔀 随机一个用户"):
-        st.session_state["demo_uid"] = random.choice(uid_all)
-        st.rerun()
+    st.button("🔀 随机一个用户", on_click=_pick_random_uid)
 
     if st.button("深度召回"):
         try:
-            st.session_state["tower_recs"] = tw.recommend_twotower(
-                df_flt, int(uid_sel), top_n
+            st.session_state["tower_recs"] = tw.recommend_twotower_cached(
+                df_flt, int(uid_sel), top_n, data_ver
             )
         except ValueError as e:
             st.error(str(e))
@@ -159,6 +208,50 @@ with tab_tower:
     if "tower_recs" in st.session_state:
         _render(st.session_state["tower_recs"], "tower")
 
+with tab_fuse:
+    st.subheader("🧩 多路召回融合")
+    st.caption("各路召回并行执行，候选集统一融合重排；输入沿用其他标签页的选择")
+
+    names = {"quality": "高质量热门", "tags": "标签", "similar": "相似游戏", "twotower": "深度召回"}
+    avail = ["quality", "similar", "twotower"] + (["tags"] if tag_sel else [])
+    ret_sel = st.multiselect("召回器", avail, default=avail[:2],
+                             format_func=names.get)
+    fusion  = st.radio("融合方式", FUSIONS, horizontal=True,
+                       format_func={"rrf": "RRF 倒数排名", "weighted": "加权分数"}.get)
+    weights = {r: st.slider(f"{names[r]} 权重", 0.0, 2.0, 1.0, 0.1, key=f"w_{r}")
+               for r in ret_sel} if fusion == "weighted" else None
+
+    if st.button("融合推荐", key="btn_fuse") and ret_sel:
+        query = {"tags": tag_sel, "game": game_sel, "sim_df": sim_sub,
+                 "alpha": alpha, "user_id": int(uid_sel), "data_ver": data_ver}
+        try:
+            st.session_state["fused_recs"] = retrieve_fused(
+                df_flt, query, ret_sel, top_n, fusion=fusion, weights=weights
+            )
+        except ValueError as e:
+            st.error(str(e))
+
+    if "fused_recs" in st.session_state:
+        recs, timings = st.session_state["fused_recs"]
+        st.caption("　".join(f"{names.get(k, k)} {v*1000:.0f} ms" for k, v in timings.items()))
+        _render(recs, "fuse")
+
+cs = RESULT_CACHE.stats()
+st.sidebar.caption(f"结果缓存 {cs['size']}/{cs['maxsize']}　命中 {cs['hits']}　未命中 {cs['misses']}")
+
+def _report_caption(label: str, r: dict):
+    mb = lambda b: b / 2**20
+    st.sidebar.caption(f"紧凑{label}：常驻 {mb(r['bytes_compact']):.1f} MB"
+                       f" (全精度 {mb(r['bytes_full']):.1f} MB)"
+                       f"　加载峰值 {mb(r['bytes_peak']):.1f} MB"
+                       f"　recall@10 {r['recall_at_k']:.3f}")
+
+if COMPACT:
+    import tower_utils as tw
+    _report_caption("相似度", sim_report)
+    if tw.compact_report():
+        _report_caption("塔向量", tw.compact_report())
+
 st.sidebar.header("⭐ 我的收藏夹")
 if fav_set:
     fav_df = (
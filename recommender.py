@@ -1,13 +1,21 @@
 import ast
+import os
+import warnings
 from pathlib import Path
 from typing import List, Union
 
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from sklearn.preprocessing import MultiLabelBinarizer
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 
+COMPACT_ENV = "SWITCHREC_COMPACT"   # =1 开启紧凑模式 (相似度 uint8、塔向量 int8)
+
+def compact_mode() -> bool:
+    return os.environ.get(COMPACT_ENV, "0") == "1"
+
 def load_data(path: Union[str, Path]) -> pd.DataFrame:
     df = pd.read_csv(path, quotechar='"', keep_default_na=False)
 
@@ -18,27 +26,126 @@ def load_data(path: Union[str, Path]) -> pd.DataFrame:
     df["text"] = df["enriched_sinopsis"] if "enriched_sinopsis" in df.columns else df["sinopsis"]
     return df
 
-def _vec_tags(df):
-    mlb = MultiLabelBinarizer()
-    return pd.DataFrame(mlb.fit_transform(df["tags"]), columns=mlb.classes_, index=df.index)
+def _vec_tags(df, mlb):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)  # 新标签不在词表中，直接忽略
+        return sp.csr_matrix(mlb.transform(df["tags"]))
+
+def _vec_text(df, tfidf):
+    return tfidf.transform(df["text"])
+
+def fit_feature_encoders(df, max_feat=800):
+    """拟合标签/TF-IDF 词表与归一化区间，供全量构建和增量更新共用"""
+    return {
+        "mlb":    MultiLabelBinarizer(sparse_output=True).fit(df["tags"]),
+        "tfidf":  TfidfVectorizer(max_features=max_feat, stop_words="english").fit(df["text"]),
+        "rating": (df["rating"].min(), df["rating"].max()),
+        "pop":    (df["popularity"].min(), df["popularity"].max()),
+    }
 
-def _vec_text(df, max_feat=800):
-    tfidf = TfidfVectorizer(max_features=max_feat, stop_words="english")
-    mat   = tfidf.fit_transform(df["text"])
-    return pd.DataFrame(mat.toarray(), columns=tfidf.get_feature_names_out(), index=df.index)
+def build_feature_csr(df, enc):
+    """稀疏特征 (行与 df 对齐)：标签 + TF-IDF 保持 CSR，不展开成稠密矩阵"""
+    tags = _vec_tags(df, enc["mlb"])
+    text = _vec_text(df, enc["tfidf"])
+    (r_lo, r_hi), (p_lo, p_hi) = enc["rating"], enc["pop"]
+    r = (df["rating"]-r_lo)/(r_hi-r_lo)
+    p = (df["popularity"]-p_lo)/(p_hi-p_lo)
+    meta = sp.csr_matrix(np.column_stack([r, p]))
+    return sp.hstack([tags, text, meta], format="csr", dtype=np.float64)
 
-def build_feature_matrix(df):
-    tags = _vec_tags(df)
-    text = _vec_text(df)
-    r = (df["rating"]-df["rating"].min())/(df["rating"].max()-df["rating"].min())
-    p = (df["popularity"]-df["popularity"].min())/(df["popularity"].max()-df["popularity"].min())
-    meta = pd.DataFrame({"scaled_rating": r, "scaled_pop": p}, index=df.index)
-    return pd.concat([tags, text, meta], axis=1)
+def build_feature_matrix(df, enc=None):
+    enc  = enc or fit_feature_encoders(df)
+    cols = [*enc["mlb"].classes_, *enc["tfidf"].get_feature_names_out(),
+            "scaled_rating", "scaled_pop"]
+    return pd.DataFrame(build_feature_csr(df, enc).toarray(), columns=cols, index=df.index)
 
 def compute_similarity(feat):
     sim = cosine_similarity(feat.values)
     return pd.DataFrame(sim, index=feat.index, columns=feat.index)
 
+def update_catalog(df, feat, sim_df, enc, df_upd):
+    """增量更新：新增/修改的游戏(按 id 匹配)沿用已有词表向量化，
+    只与现有条目打分 O(k·n)，返回新的 (df, feat, sim_df)，不修改传入对象；
+    feat 为与 df 行对齐的稀疏特征 (build_feature_csr)"""
+    known = pd.Series(df.index, index=df["id"])
+    is_old = df_upd["id"].isin(known.index).to_numpy()
+    new_idx = df.index.max() + 1 + np.arange((~is_old).sum())
+    labels = np.empty(len(df_upd), dtype=df.index.dtype)
+    labels[is_old]  = known.reindex(df_upd["id"][is_old]).to_numpy()
+    labels[~is_old] = new_idx
+    df_upd = df_upd.set_axis(labels)
+
+    order = df.index.append(pd.Index(new_idx))
+    df    = pd.concat([df.drop(index=labels[is_old]), df_upd]).loc[order]
+    pos   = order.get_indexer(labels)
+    f_upd = build_feature_csr(df_upd, enc)
+    src   = np.concatenate([np.arange(feat.shape[0]), np.zeros(len(new_idx), dtype=int)])
+    src[pos] = feat.shape[0] + np.arange(len(df_upd))   # 每行取自 [feat; f_upd] 的哪一行
+    feat  = sp.vstack([feat, f_upd], format="csr")[src]
+
+    n0  = len(sim_df)
+    sim = np.empty((len(order), len(order)), dtype=sim_df.values.dtype)
+    sim[:n0, :n0] = sim_df.values
+    s   = _quantize_sim(cosine_similarity(f_upd, feat), sim.dtype)
+    sim[pos, :] = s
+    sim[:, pos] = s.T
+    return df, feat, pd.DataFrame(sim, index=order, columns=order)
+
+def _quantize_sim(sim, dtype):
+    # 特征非负 → 余弦相似度在 [0,1]，uint8 用固定刻度 1/255
+    if np.dtype(dtype) == np.uint8:
+        return np.rint(np.clip(sim, 0, 1)*255).astype(np.uint8)
+    return sim.astype(dtype, copy=False)
+
+def _sim_values(sim):
+    return sim / 255 if sim.dtype == np.uint8 else sim
+
+def compact_similarity(sim_df, dtype="uint8"):
+    """紧凑模式：相似度存为 uint8 / float16 (内存为 float64 的 1/8 / 1/4)"""
+    return pd.DataFrame(_quantize_sim(sim_df.values, dtype),
+                        index=sim_df.index, columns=sim_df.index)
+
+SIM_BLOCK = 512   # 紧凑模式下每次计算的相似度行数
+
+def build_similarity(feat, index, compact=None, k=10, n_query=200, seed=0):
+    """由稀疏特征计算全量相似度，非紧凑模式 report 为 None。
+    紧凑模式按行分块计算并直接量化进预分配的 uint8 矩阵，不生成 n×n float64；
+    report 给出常驻/峰值内存与抽样行上的 recall@K"""
+    if not (compact_mode() if compact is None else compact):
+        return pd.DataFrame(cosine_similarity(feat), index=index, columns=index), None
+
+    n    = feat.shape[0]
+    sim  = np.empty((n, n), dtype=np.uint8)
+    rows = np.sort(np.random.default_rng(seed).choice(n, min(n_query, n), replace=False))
+    full = np.empty((len(rows), n))   # 只保留抽样行的全精度分数用于评估
+    block_bytes = 0
+    for a in range(0, n, SIM_BLOCK):
+        blk = cosine_similarity(feat[a:a+SIM_BLOCK], feat)
+        sim[a:a+len(blk)] = _quantize_sim(blk, np.uint8)
+        hit = (rows >= a) & (rows < a + len(blk))
+        full[hit] = blk[rows[hit] - a]
+        block_bytes = max(block_bytes, blk.nbytes)
+
+    approx = _sim_values(sim[rows]).astype(np.float64)
+    diag = np.arange(len(rows))
+    full[diag, rows] = approx[diag, rows] = -np.inf   # 排除自身
+    feat_bytes = feat.data.nbytes + feat.indices.nbytes + feat.indptr.nbytes
+    report = {"bytes_full":    n*n*8 + feat_bytes,
+              "bytes_compact": sim.nbytes + feat_bytes,
+              "bytes_peak":    sim.nbytes + feat_bytes + 2*block_bytes + full.nbytes + approx.nbytes,
+              "recall_at_k":   recall_at_k(full, approx, k)}
+    return pd.DataFrame(sim, index=index, columns=index), report
+
+def recall_at_k(full, approx, k=10):
+    """逐行比较 Top-K：近似打分召回的 Top-K 中命中全精度 Top-K 的比例"""
+    k = min(k, full.shape[1] - 1)   # argpartition 要求 k < 列数
+    if k < 1:
+        return 1.0
+    top_f = np.argpartition(-full, k, axis=1)[:, :k]
+    top_a = np.argpartition(-approx, k, axis=1)[:, :k]
+    hit = [len(np.intersect1d(f, a)) for f, a in zip(top_f, top_a)]
+    return float(np.mean(hit)) / k
+
 def get_top_quality(df, n=10):
     q = df["rating"].fillna(0)*np.log1p(df["ratings_count"])
     return df.assign(qscore=q).sort_values("qscore", ascending=False).head(n)
@@ -54,7 +161,7 @@ def recommend_hybrid(df, sim_df, game, n=10, alpha=0.7):
     if game not in df["name"].values:
         raise ValueError(f"{game} not found")
     idx = df.index[df["name"]==game][0]
-    sim = sim_df[idx]
+    sim = _sim_values(sim_df[idx])
     qual = (df["rating"].fillna(0)*np.log1p(df["ratings_count"]))
     qual = (qual-qual.min())/(qual.max()-qual.min())
     score = alpha*sim + (1-alpha)*qual
@@ -0,0 +1,74 @@
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable
+
+import pandas as pd
+
+def _normalize(v: Any) -> Hashable:
+    # 参数归一化：顺序无关的集合排序，浮点数截断，保证同一查询得到同一 key
+    if isinstance(v, dict):
+        return tuple(sorted((k, _normalize(x)) for k, x in v.items()))
+    if isinstance(v, (set, frozenset)):
+        return tuple(sorted(_normalize(x) for x in v))
+    if isinstance(v, (list, tuple)):
+        return tuple(_normalize(x) for x in v)
+    if isinstance(v, float):
+        return round(v, 6)
+    return v
+
+def mask_hash(df: pd.DataFrame, col: str = "id") -> str:
+    """过滤后的候选集指纹：同一批游戏且顺序相同才得到同一 hash"""
+    rows = pd.util.hash_pandas_object(df[col], index=False).to_numpy()
+    return hashlib.blake2b(rows.tobytes(), digest_size=8).hexdigest()
+
+class ResultCache:
+    """跨会话共享的推荐结果 LRU 缓存
+    key = (recommender, 归一化参数, 过滤集 hash, 数据版本)；
+    某个推荐器的数据版本变化时，自动清掉它的旧结果"""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize  = maxsize
+        self.hits     = 0
+        self.misses   = 0
+        self._data    = OrderedDict()
+        self._version = {}
+        self._lock    = Lock()
+
+    def _invalidate(self, name: str, version: Hashable):
+        if self._version.get(name, version) != version:
+            for k in [k for k in self._data if k[0] == name]:
+                del self._data[k]
+        self._version[name] = version
+
+    def get_or_compute(self, name: str, params: dict, df: pd.DataFrame,
+                       version: Hashable, fn: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        key = (name, _normalize(params), mask_hash(df), version)
+        with self._lock:
+            self._invalidate(name, version)
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key].copy()
+            self.misses += 1
+
+        out = fn()  # 计算时不持锁，异常直接抛给调用方
+        with self._lock:
+            if self._version.get(name) == version:
+                self._data[key] = out
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return out.copy()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._version.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses}
+
+RESULT_CACHE = ResultCache()
@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from recommender import get_top_quality, recommend_by_tags, recommend_hybrid
+from result_cache import RESULT_CACHE
+
+# 与各标签页使用相同的缓存 key，融合召回与单路召回互相复用结果
+def _quality(df, q, k):
+    return RESULT_CACHE.get_or_compute(
+        "quality", {"n": k}, df, q.get("data_ver"),
+        lambda: get_top_quality(df, k))["qscore"]
+
+def _tags(df, q, k):
+    return RESULT_CACHE.get_or_compute(
+        "tags", {"tags": set(q["tags"]), "n": k}, df, q.get("data_ver"),
+        lambda: recommend_by_tags(df.copy(), q["tags"], k))["match"]
+
+def _similar(df, q, k):
+    alpha = q.get("alpha", 0.7)
+    return RESULT_CACHE.get_or_compute(
+        "hybrid", {"game": q["game"], "n": k, "alpha": alpha}, df, q.get("data_ver"),
+        lambda: recommend_hybrid(df, q["sim_df"], q["game"], k, alpha))["hybrid_score"]
+
+def _twotower(df, q, k):
+    import tower_utils as tw
+    return tw.recommend_twotower_cached(df, q["user_id"], k, q.get("data_ver"))["tower_score"]
+
+# 每个召回器返回按分数降序、以 df.index 为索引的候选分数 Series (最多 k 条)
+RETRIEVERS = {
+    "quality":  _quality,
+    "tags":     _tags,
+    "similar":  _similar,
+    "twotower": _twotower,
+}
+FUSIONS = ("rrf", "weighted")
+
+def retrieve_fused(df: pd.DataFrame, query: dict, retrievers: List[str],
+                   n: int = 10, n_cand: int = 100, fusion: str = "rrf",
+                   weights: Optional[Dict[str, float]] = None, rrf_k: int = 60):
+    """多路召回并行执行，再统一融合重排
+    fusion="rrf": Σ w/(rrf_k+rank)；fusion="weighted": Σ w·minmax(score)
+    返回 (结果 DataFrame[fused_score], 各阶段耗时 秒)"""
+    if fusion not in FUSIONS:
+        raise ValueError(f"未知融合方式 {fusion!r}，可选 {FUSIONS}")
+    weights = weights or {}
+    timings = {}
+
+    def _run(name):
+        t = perf_counter()
+        s = RETRIEVERS[name](df, query, n_cand)
+        timings[name] = perf_counter() - t
+        return s
+
+    t0 = perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, len(retrievers))) as ex:
+        futs  = {name: ex.submit(_run, name) for name in retrievers}
+        cands = {name: f.result() for name, f in futs.items()}
+    timings["retrieve"] = perf_counter() - t0
+
+    t = perf_counter()
+    score  = np.zeros(len(df))
+    member = np.zeros(len(df), dtype=bool)   # 是否进入任一候选集，与分数高低无关
+    for name, s in cands.items():
+        if s.empty:
+            continue
+        pos = df.index.get_indexer(s.index)
+        member[pos] = True
+        w   = weights.get(name, 1.0)
+        if fusion == "rrf":
+            score[pos] += w / (rrf_k + np.arange(1, len(s) + 1))
+        else:
+            v = s.to_numpy(dtype=float)
+            score[pos] += w * ((v - v.min()) / np.ptp(v) if np.ptp(v) else np.ones_like(v))
+    if "similar" in retrievers:
+        member[(df["name"] == query["game"]).to_numpy()] = False   # 不推荐种子游戏本身
+
+    cand = np.flatnonzero(member)
+    k    = min(n, len(cand))
+    top  = cand[np.argpartition(-score[cand], k - 1)[:k]] if k else cand
+    top  = top[np.argsort(-score[top], kind="stable")]
+    out = df.iloc[top].assign(fused_score=score[top])
+    timings["fuse"]  = perf_counter() - t
+    timings["total"] = perf_counter() - t0
+    return out, timings
@@ -1,55 +1,204 @@
 from pathlib import Path
+from threading import Lock, RLock
+import os, tempfile
 import numpy as np
 import pandas as pd
 
+from recommender import compact_mode, recall_at_k
+
 DATA_DIR   = Path("data")
 INTER_CSV  = DATA_DIR / "interactions.csv"
 EMB_PKL    = DATA_DIR / "item_text_emb.pkl"
+UPD_EMB_PKL = DATA_DIR / "item_text_emb_updates.pkl"   # 增量：新增/修改游戏的文本向量
+ID_INDEX   = DATA_DIR / "id_index.npz"                 # 由 INTER_CSV 生成的 id 索引
 CKPT       = Path("dl_recomm/twotower.ckpt")
 
 TXT_DIM = 384
 EMB_DIM = 64
 
+# asset 的加载 / 增量更新 / 同步会被多个会话线程和召回线程池并发调用；
+# 可重入：update_items、sync_item_updates 内部会再调用 _load_asset
+_ASSET_LOCK = RLock()
+_INDEX_LOCK = Lock()
+
+def _quantize_rows(mat):
+    mat   = np.asarray(mat, dtype=np.float32)
+    scale = np.abs(mat).max(axis=1) / 127
+    scale[scale == 0] = 1
+    return np.rint(mat / scale[:, None]).astype(np.int8), scale.astype(np.float32)
+
+class Int8Vecs:
+    """逐行对称 int8 量化 v ≈ q * scale；查询同样量化，分块 int32 累加打分，
+    临时内存只与块大小有关，不还原整张矩阵"""
+
+    CHUNK = 65536
+
+    def __init__(self, mat):
+        self.q, self.scale = _quantize_rows(mat)
+
+    def __len__(self):
+        return len(self.q)
+
+    def __getitem__(self, i):
+        return self.q[i].astype(np.float32) * self.scale[i]
+
+    def __matmul__(self, v):
+        v = np.asarray(v, dtype=np.float32)
+        qv, sv = _quantize_rows(v.reshape(1, -1) if v.ndim == 1 else v.T)
+        qv = qv.T.astype(np.int32)
+        out = np.empty((len(self.q), qv.shape[1]), dtype=np.float32)
+        for a in range(0, len(self.q), self.CHUNK):
+            b = a + self.CHUNK
+            out[a:b] = self.q[a:b].astype(np.int32) @ qv
+        out *= self.scale[:, None] * sv
+        return out[:, 0] if v.ndim == 1 else out
+
+    def __array__(self, dtype=None, copy=None):
+        return (self.q * self.scale[:, None]).astype(dtype or np.float32)
+
+    @property
+    def nbytes(self):
+        return self.q.nbytes + self.scale.nbytes
+
+class UserIndex:
+    """排序后的 user_id 数组 + 训练时的编码；
+    成员判断/取编码走哈希 O(1)，搜索/分页走有序数组，不展开成 Python list"""
+
+    def __init__(self, ids, enc):
+        self.ids  = ids
+        self.enc  = enc
+        self._pos = pd.Index(ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, uid):
+        return uid in self._pos
+
+    def __getitem__(self, uid):
+        return int(self.enc[self._pos.get_loc(uid)])
+
+    def position(self, uid) -> int:
+        return self._pos.get_loc(uid)
+
+    def page(self, i: int, size: int = 50) -> list:
+        return self.ids[i*size:(i+1)*size].tolist()
+
+    def search(self, prefix: str, limit: int = 50) -> list:
+        # 前缀为 p 的 id 在有序数组中是若干连续区间 [p·10^k, (p+1)·10^k)；
+        # id 不含前导零，以 "0" 开头的前缀没有匹配 (也避免 p=0 时区间不前进)
+        if not prefix.isdigit() or prefix.startswith("0"):
+            return []
+        p = int(prefix)
+        out = [p] if p in self else []
+        lo, hi = p*10, p*10 + 10
+        while len(out) < limit and len(self.ids) and lo <= self.ids[-1]:
+            a, b = np.searchsorted(self.ids, [lo, hi])
+            out.extend(self.ids[a:b][:limit-len(out)].tolist())
+            lo, hi = lo*10, hi*10
+        return out
+
+def _build_id_index():
+    df = pd.read_csv(INTER_CSV, usecols=["user_id", "game_id"])
+    u_uniq = df.user_id.unique()          # 编码 = 首次出现顺序，与训练一致
+    order  = np.argsort(u_uniq, kind="stable")
+    # 先写临时文件再原子替换，其他会话/进程不会读到写了一半的索引
+    fd, tmp = tempfile.mkstemp(dir=ID_INDEX.parent, suffix=".npz")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, user_ids=u_uniq[order], user_enc=order,
+                     item_ids=df.game_id.unique())
+        os.replace(tmp, ID_INDEX)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def load_id_index():
+    """持久化 id 索引，进程内只加载一次；INTER_CSV 更新后自动重建并重新加载。
+    部署时可只提供 ID_INDEX 而不带 INTER_CSV"""
+    with _INDEX_LOCK:
+        if INTER_CSV.exists():
+            mtime = INTER_CSV.stat().st_mtime
+            if not ID_INDEX.exists() or ID_INDEX.stat().st_mtime < mtime:
+                _build_id_index()
+        src = ID_INDEX.stat().st_mtime
+        if getattr(load_id_index, "_src", None) != src:
+            with np.load(ID_INDEX) as z:
+                load_id_index._idx = (UserIndex(z["user_ids"], z["user_enc"]),
+                                      z["item_ids"])
+            load_id_index._src = src
+        return load_id_index._idx
+
 def _load_uid_iid_maps():
-    df = pd.read_csv(INTER_CSV)
-    u2enc = {u: i for i, u in enumerate(df.user_id.unique())}
-    i2enc = {g: i for i, g in enumerate(df.game_id.unique())}
-    return u2enc, i2enc, df.user_id.unique().tolist()
+    users, item_ids = load_id_index()
+    i2enc = {int(g): i for i, g in enumerate(item_ids)}
+    return users, i2enc, users
 
-def recommend_twotower(df_items: pd.DataFrame, user_id: int, topk: int = 10):
+def _load_asset():
     import pickle, torch, torch.nn as nn, pytorch_lightning as pl
 
-    if not hasattr(recommend_twotower, "_asset"):
-        uid2enc, iid2enc, uid_list = _load_uid_iid_maps()
+    with _ASSET_LOCK:
+        load_id_index()   # 先按需重建索引，src 才能反映最终的 ID_INDEX
+        src = (artifact_mtimes(), compact_mode())
+        if getattr(recommend_twotower, "_src", None) != src:
+            uid2enc, iid2enc, uid_list = _load_uid_iid_maps()
 
-        class TwoTower(pl.LightningModule):
-            def __init__(self, n_user, n_item, txt_dim=TXT_DIM):
-                super().__init__()
-                self.u_emb  = nn.Embedding(n_user, EMB_DIM)
-                self.i_id_emb = nn.Embedding(n_item, EMB_DIM)
-                self.i_txt  = nn.Linear(txt_dim, EMB_DIM)
+            class TwoTower(pl.LightningModule):
+                def __init__(self, n_user, n_item, txt_dim=TXT_DIM):
+                    super().__init__()
+                    self.u_emb  = nn.Embedding(n_user, EMB_DIM)
+                    self.i_id_emb = nn.Embedding(n_item, EMB_DIM)
+                    self.i_txt  = nn.Linear(txt_dim, EMB_DIM)
 
-        model = TwoTower(len(uid2enc), len(iid2enc))
-        model = TwoTower.load_from_checkpoint(CKPT, map_location="cpu").eval()
+            model = TwoTower(len(uid2enc), len(iid2enc))
+            model = TwoTower.load_from_checkpoint(CKPT, map_location="cpu").eval()
 
-        with open(EMB_PKL, "rb") as f:
-            txt_emb = pickle.load(f)  # rawg_id -> np.array(384,)
+            with open(EMB_PKL, "rb") as f:
+                txt_emb = pickle.load(f)  # rawg_id -> np.array(384,)
 
-        item_vecs = np.zeros((len(iid2enc), EMB_DIM), dtype=np.float32)
-        with torch.no_grad():
-            for rid, enc in iid2enc.items():
-                txt = torch.tensor(txt_emb.get(rid, np.zeros(TXT_DIM)),
-                                   dtype=torch.float32).unsqueeze(0)
-                item_vecs[enc] = (model.i_id_emb(torch.tensor([enc])) + model.i_txt(txt)).numpy()[0]
+            item_vecs = np.zeros((len(iid2enc), EMB_DIM), dtype=np.float32)
+            with torch.no_grad():
+                for rid, enc in iid2enc.items():
+                    txt = torch.tensor(txt_emb.get(rid, np.zeros(TXT_DIM)),
+                                       dtype=torch.float32).unsqueeze(0)
+                    item_vecs[enc] = (model.i_id_emb(torch.tensor([enc])) + model.i_txt(txt)).numpy()[0]
+
+            user_vecs = model.u_emb.weight.detach().numpy()
+            if compact_mode():
+                item_q, user_q = Int8Vecs(item_vecs), Int8Vecs(user_vecs)
+                recommend_twotower._compact_report = _compact_report(
+                    item_vecs, user_vecs, item_q, user_q)
+                item_vecs, user_vecs = item_q, user_q
+                del model.u_emb   # 用户向量只保留量化版
+
+            recommend_twotower._asset = (model, uid2enc, iid2enc, item_vecs, user_vecs, uid_list)
+            recommend_twotower._version = 0
+            recommend_twotower._src = src
+            recommend_twotower._upd_mtime = None   # 重新加载后需重放增量更新
 
-        recommend_twotower._asset = (model, uid2enc, iid2enc, item_vecs, uid_list)
+        return recommend_twotower._asset
 
-    model, uid2enc, iid2enc, item_vecs, uid_list = recommend_twotower._asset
+def _compact_report(item_vecs, user_vecs, item_q, user_q, k=10, n_query=200, seed=0):
+    """int8 量化的内存节省与 recall@K (相对全精度)"""
+    rng  = np.random.default_rng(seed)
+    rows = rng.choice(len(user_vecs), min(n_query, len(user_vecs)), replace=False)
+    full   = user_vecs[rows] @ item_vecs.T
+    approx = (item_q @ (user_q.q[rows] * user_q.scale[rows, None]).T).T
+    return {"bytes_full": item_vecs.nbytes + user_vecs.nbytes,
+            "bytes_compact": item_q.nbytes + user_q.nbytes,
+            "bytes_peak": item_vecs.nbytes + user_vecs.nbytes + item_q.nbytes + user_q.nbytes,
+            "recall_at_k": recall_at_k(full, approx, k)}
+
+def compact_report():
+    return getattr(recommend_twotower, "_compact_report", None)
+
+def recommend_twotower(df_items: pd.DataFrame, user_id: int, topk: int = 10):
+    model, uid2enc, iid2enc, item_vecs, user_vecs, uid_list = _load_asset()
 
     if user_id not in uid2enc:
         raise ValueError(f"user_id {user_id} 不在 interactions.csv！")
 
-    u_vec = model.u_emb(torch.tensor([uid2enc[user_id]])).detach().numpy()[0]
+    u_vec = user_vecs[uid2enc[user_id]]
     sims  = item_vecs @ u_vec
     top_idx = sims.argsort()[::-1][:topk]
 
@@ -60,7 +209,70 @@ def recommend_twotower(df_items: pd.DataFrame, user_id: int, topk: int = 10):
     out["tower_score"] = out["rawg_id"].astype(int).map(score_map)
     return out.sort_values("tower_score", ascending=False)
 
-def get_all_user_ids():
-    if hasattr(recommend_twotower, "_asset"):
-        return recommend_twotower._asset[-1]
-    return _load_uid_iid_maps()[-1]
+def recommend_twotower_cached(df_items: pd.DataFrame, user_id: int, topk: int = 10,
+                              data_ver=None) -> pd.DataFrame:
+    """先同步增量更新，再走共享结果缓存；深度召回页与融合召回共用"""
+    from result_cache import RESULT_CACHE
+
+    ver = (data_ver, sync_item_updates())
+    return RESULT_CACHE.get_or_compute(
+        "twotower", {"user_id": user_id, "n": topk}, df_items, ver,
+        lambda: recommend_twotower(df_items, user_id, topk))
+
+def get_all_user_ids() -> UserIndex:
+    return load_id_index()[0]
+
+def update_items(txt_emb_upd: dict) -> tuple:
+    """增量更新游戏塔向量 (rawg_id -> np.array(384,))，无需重训：
+    已有游戏用 id+新文本重算，新游戏冷启动只用 i_txt(文本)。
+    以新版本整体替换 asset，返回 asset_version()"""
+    import torch
+
+    with _ASSET_LOCK:
+        model, uid2enc, iid2enc, item_vecs, user_vecs, uid_list = _load_asset()
+        iid2enc = dict(iid2enc)
+        for rid in txt_emb_upd:
+            iid2enc.setdefault(rid, len(iid2enc))
+        vecs = np.zeros((len(iid2enc), EMB_DIM), dtype=np.float32)
+        vecs[:len(item_vecs)] = np.asarray(item_vecs)
+
+        n_trained = model.i_id_emb.num_embeddings
+        with torch.no_grad():
+            for rid, emb in txt_emb_upd.items():
+                enc = iid2enc[rid]
+                v = model.i_txt(torch.tensor(emb, dtype=torch.float32).unsqueeze(0))
+                if enc < n_trained:
+                    v = v + model.i_id_emb(torch.tensor([enc]))
+                vecs[enc] = v.numpy()[0]
+
+        if isinstance(item_vecs, Int8Vecs):   # 与当前 asset 的存储方式保持一致
+            vecs = Int8Vecs(vecs)
+
+        recommend_twotower._asset = (model, uid2enc, iid2enc, vecs, user_vecs, uid_list)
+        recommend_twotower._version += 1
+        return asset_version()
+
+def artifact_mtimes() -> tuple:
+    """模型相关文件的修改时间；任一变化都会触发 asset 重新加载"""
+    return tuple(p.stat().st_mtime if p.exists() else 0.0
+                 for p in (CKPT, INTER_CSV, ID_INDEX, EMB_PKL))
+
+def asset_version() -> tuple:
+    """(加载时的文件版本, 增量更新次数)，作为结果缓存的版本"""
+    return (getattr(recommend_twotower, "_src", None),
+            getattr(recommend_twotower, "_version", 0))
+
+def sync_item_updates() -> tuple:
+    """先按需重新加载 asset，再在 UPD_EMB_PKL 有变化时增量发布新版本；
+    返回同步后的 asset_version()"""
+    import pickle
+
+    with _ASSET_LOCK:
+        _load_asset()
+        if UPD_EMB_PKL.exists():
+            mtime = UPD_EMB_PKL.stat().st_mtime
+            if getattr(recommend_twotower, "_upd_mtime", None) != mtime:
+                with open(UPD_EMB_PKL, "rb") as f:
+                    update_items(pickle.load(f))
+                recommend_twotower._upd_mtime = mtime
+        return asset_version()